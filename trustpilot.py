@@ -1,22 +1,50 @@
 """
 Implementation of Trustpilot's Pony Challenge.
 
-Uses simple BFS to reach the goal. If there is no path to the goal,
+Uses A* to reach the goal. If there is no path to the goal,
 the Pony naively tries to take the move that maximizes Manhatten distance
 to Domokun.
 
 Code formatted using Black.
 """
-import json
 import argparse
 import curses
-from collections import defaultdict
+import functools
+import heapq
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import _curses
 
+try:
+    # orjson parses the per-turn state considerably faster when available
+    import orjson as json
+except ImportError:
+    import json
+
 BASE = "https://ponychallenge.trustpilot.com/pony-challenge"
 HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
 
+# wall bits of a maze cell
+NORTH, EAST, SOUTH, WEST = 1, 2, 4, 8
+
+# (row, column) deltas of the moves, along with the wall blocking each of them
+_MOVE_MAP = {(0, -1): "west", (1, 0): "south", (0, 1): "east", (-1, 0): "north"}
+_DELTAS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+_DELTA_WALLS = (WEST, SOUTH, EAST, NORTH)
+
+# a single keep-alive session, so every turn reuses the same TLS connection
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    ),
+)
+
 # pylint: disable=too-many-instance-attributes
 class Maze:
     """A wrapper for the Maze in which the action takes place"""
@@ -28,33 +56,49 @@ class Maze:
         self.difficulty = difficulty
         self.maze_id = self._new_maze_id(width, height, name, difficulty)
 
+        # cells are addressed by their flat index in the grid
         data = self._get_maze_state()
-        self.pony = self._coord_from_index(data["pony"][0])
-        self.domokun = self._coord_from_index(data["domokun"][0])
-        self.goal = self._coord_from_index(data["end-point"][0])
+        self.pony = data["pony"][0]
+        self.domokun = data["domokun"][0]
+        self.goal = data["end-point"][0]
         self.state = "active"
 
         grid = data["data"]
 
-        # represent maze as an adjacency list
-        self.maze = defaultdict(set)
-        for idx, walls in enumerate(grid):
-            row, column = self._coord_from_index(idx)
-            if "west" not in walls:
-                self.maze[(row, column)].add((row, column - 1))
-                self.maze[(row, column - 1)].add((row, column))
-            if "north" not in walls:
-                self.maze[(row, column)].add((row - 1, column))
-                self.maze[(row - 1, column)].add((row, column))
+        # represent maze as one byte of wall bits per cell,
+        # treating the outer edges of the maze as walls
+        walls_map = bytearray(width * height)
+        for row in range(height):
+            for column in range(width):
+                idx = row * width + column
+                walls = grid[idx]
+                if "north" in walls or row == 0:
+                    walls_map[idx] |= NORTH
+                    if row > 0:
+                        walls_map[idx - width] |= SOUTH
+                if "west" in walls or column == 0:
+                    walls_map[idx] |= WEST
+                    if column > 0:
+                        walls_map[idx - 1] |= EAST
+                if row == height - 1:
+                    walls_map[idx] |= SOUTH
+                if column == width - 1:
+                    walls_map[idx] |= EAST
+
+        # the walls never change, so freeze them to be usable as a cache key
+        self.walls = bytes(walls_map)
+        self._frame = self._render_walls()
 
     def _get_maze_state(self):
-        return requests.get(f"{BASE}/maze/{self.maze_id}", headers=HEADERS).json()
+        return json.loads(SESSION.get(f"{BASE}/maze/{self.maze_id}").content)
 
     def _update_state(self):
-        data = self._get_maze_state()
-        self.pony = self._coord_from_index(data["pony"][0])
-        self.domokun = self._coord_from_index(data["domokun"][0])
-        self.goal = self._coord_from_index(data["end-point"][0])
+        self._apply_state(self._get_maze_state())
+
+    def _apply_state(self, data):
+        self.pony = data["pony"][0]
+        self.domokun = data["domokun"][0]
+        self.goal = data["end-point"][0]
         self.state = data["game-state"]["state"]
 
     @staticmethod
@@ -65,46 +109,112 @@ class Maze:
             "maze-player-name": name,
             "difficulty": difficulty,
         }
-        data = json.dumps(args)
-
-        response = requests.post(f"{BASE}/maze", data, headers=HEADERS)
-        return response.json()["maze_id"]
+        response = SESSION.post(f"{BASE}/maze", data=json.dumps(args))
+        return json.loads(response.content)["maze_id"]
 
     def _coord_from_index(self, index):
         row = index // self.width
         column = index % self.width
         return (row, column)
 
+    def _render_walls(self):
+        """ASCII drawing of the walls, in the style of the API's /print"""
+        lines = []
+        for row in range(self.height):
+            cells = self.walls[row * self.width : (row + 1) * self.width]
+            lines.append("".join("+---" if c & NORTH else "+   " for c in cells) + "+")
+            lines.append("".join("|   " if c & WEST else "    " for c in cells) + "|")
+        lines.append("+---" * self.width + "+")
+        return "\n".join(lines) + "\n"
+
     def __repr__(self):
-        response = requests.get(f"{BASE}/maze/{self.maze_id}/print", headers=HEADERS)
-        return response.content.decode()
+        # only the sprites move, so draw them onto the cached walls
+        frame = list(self._frame)
+        line_length = 4 * self.width + 2
+        for idx, sprite in ((self.goal, "E"), (self.pony, "P"), (self.domokun, "D")):
+            row, column = self._coord_from_index(idx)
+            frame[(2 * row + 1) * line_length + 4 * column + 2] = sprite
+        return "".join(frame)
 
     def move(self, move):
         """Move the Pony in (north|east|west|south) direction"""
         args = {"direction": move}
-        data = json.dumps(args)
-        _response = requests.post(f"{BASE}/maze/{self.maze_id}", data, headers=HEADERS)
-        self._update_state()
+        response = SESSION.post(f"{BASE}/maze/{self.maze_id}", data=json.dumps(args))
+        response = json.loads(response.content)
+
+        # use the state in the move response if it has the full picture,
+        # otherwise only fetch it if the game is still going
+        if all(key in response for key in ("pony", "domokun", "end-point")):
+            self._apply_state(response)
+        elif response.get("state", "active").lower() != "active":
+            self.state = response["state"].lower()
+        else:
+            self._update_state()
 
     def __getitem__(self, item):
-        return self.maze[item]
-
-
-def bfs(maze):
-    """Basic BFS implementation, viewing Domokun as a wall"""
-    queue = [(maze.pony, [maze.pony])]
-    while queue:
-        (pos, path) = queue.pop()
-        for neighbor in maze[pos]:
-            if neighbor == maze.goal:
-                return path + [neighbor]
-            if neighbor in path or neighbor == maze.domokun:
-                continue
+        return _neighbors(self.walls, self.width, item)
 
-            queue.append((neighbor, path + [neighbor]))
+
+def _offsets(width):
+    """Index offsets of the moves, along with the wall blocking each of them"""
+    return tuple(
+        (wall, d_row * width + d_column)
+        for wall, (d_row, d_column) in zip(_DELTA_WALLS, _DELTAS)
+    )
+
+
+def _neighbors(walls, width, idx):
+    """Cells reachable in one move from cell idx"""
+    cell = walls[idx]
+    return [idx + offset for wall, offset in _offsets(width) if not cell & wall]
+
+
+def a_star(maze):
+    """
+    A* using Manhattan distance to the goal as heuristic, viewing Domokun as a wall.
+    Dancing with Domokun repeats the same positions, so results are memoized.
+    """
+    return _a_star(maze.walls, maze.width, maze.pony, maze.domokun, maze.goal)
+
+
+@functools.lru_cache(maxsize=4096)
+def _a_star(walls, width, pony, domokun, goal):
+    goal_row, goal_column = divmod(goal, width)
+    offsets = _offsets(width)
+
+    def h(idx):
+        row, column = divmod(idx, width)
+        return abs(row - goal_row) + abs(column - goal_column)
+
+    # flat per-cell arrays rather than dicts, no path is longer than the maze
+    size = len(walls)
+    g_score = [size] * size
+    parent = [-1] * size
+    g_score[pony] = 0
+    heap = [(h(pony), 0, pony)]
+    while heap:
+        _f, g, idx = heapq.heappop(heap)
+        if idx == goal:
+            # walk the parents back to the Pony
+            path = [idx]
+            while idx != pony:
+                idx = parent[idx]
+                path.append(idx)
+            return tuple(reversed(path))
+        if g > g_score[idx]:
+            # stale entry, a shorter way here was found later
+            continue
+        cell = walls[idx]
+        for wall, offset in offsets:
+            neighbor = idx + offset
+            if cell & wall or neighbor == domokun or g + 1 >= g_score[neighbor]:
+                continue
+            g_score[neighbor] = g + 1
+            parent[neighbor] = idx
+            heapq.heappush(heap, (g + 1 + h(neighbor), g + 1, neighbor))
 
     # no path to goal
-    return []
+    return ()
 
 
 # pylint: disable=invalid-name
@@ -116,8 +226,13 @@ def backup(maze):
     Sometimes the Pony and Domokun just end up dancing, which is cool.
     """
     moves = maze[maze.pony]
-    d = maze.domokun
-    return sorted(moves, key=lambda m: abs(m[0] - d[1]) + abs(m[1] - d[1]))[-1]
+    d = divmod(maze.domokun, maze.width)
+
+    def distance(move):
+        m = divmod(move, maze.width)
+        return abs(m[0] - d[0]) + abs(m[1] - d[1])
+
+    return max(moves, key=distance)
 
 
 def get_move(maze):
@@ -125,13 +240,12 @@ def get_move(maze):
     Takes shortest path to goal if there is a path.
     If there is no shortest path, tries to move away from Domokun
     """
-    pony = maze.pony
-    path = bfs(maze)
+    path = a_star(maze)
     move = path[1] if path else backup(maze)
+    pony = divmod(maze.pony, maze.width)
+    move = divmod(move, maze.width)
     delta = (move[0] - pony[0], move[1] - pony[1])
-    move_map = {(0, -1): "west", (1, 0): "south", (0, 1): "east", (-1, 0): "north"}
-
-    return move_map[delta]
+    return _MOVE_MAP[delta]
 
 
 def play(width, height, name, difficulty):